@@ -4,25 +4,36 @@
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+_WALLET_LIST_FIELDS = ("name", "wallet_name", "wallet_id", "currency",
+					   "wallet_status", "is_primary_wallet", "account_number",
+					   "wallet_sequence")
+
+_BULK_WALLET_FIELDS = ("name", "owner", "creation", "modified", "modified_by",
+					   "site_name", "wallet_name", "currency", "wallet_status", "description",
+					   "bvn", "is_primary_wallet", "wallet_sequence", "wallet_id", "account_type",
+					   "created_by_user", "creation_timestamp")
+
+# Columns refreshed when a wallet is re-sent for the same site; sequence,
+# primary flag and creation details are kept from the original row
+_UPSERT_WALLET_FIELDS = ("currency", "wallet_id", "description", "account_number", "exchange_ref",
+						 "business_id", "account_type", "bank_code", "bank_name", "bvn",
+						 "modified", "modified_by")
 
 class ClientWallet(Document):
 	def before_insert(self):
 		"""Handle wallet sequence and validation before inserting"""
 		
+		# Primary and count checks share one aggregate query;
+		# before_save reuses the result through self.flags
+		self.flags._wallet_stats = _site_wallet_stats(self.site_name, self.name or "")
+		
 		# Auto-generate wallet sequence for the site
-		existing_wallets = frappe.get_all("Client Wallet", 
-										filters={"site_name": self.site_name}, 
-										fields=["wallet_sequence"],
-										order_by="wallet_sequence desc",
-										limit=1)
-		
-		if existing_wallets:
-			self.wallet_sequence = existing_wallets[0].wallet_sequence + 1
-		else:
-			self.wallet_sequence = 1
+		self.wallet_sequence = _reserve_wallet_sequence(self.site_name)
 		
-		# Set created_by_user
-		self.created_by_user = frappe.session.user
+		# Set created_by_user; bulk creation passes the session user in via flags
+		self.created_by_user = self.flags.get("_created_by") or frappe.session.user
 		
 		# Generate unique wallet_id if not set
 		if not self.wallet_id:
@@ -31,39 +42,52 @@ class ClientWallet(Document):
 	def before_save(self):
 		"""Validate wallet constraints before saving"""
 		
+		wallet_stats = self.flags.pop("_wallet_stats", None) or _site_wallet_stats(self.site_name, self.name or "")
+		primary_count, wallet_count = wallet_stats
+		
 		# Ensure only one primary wallet per site
-		if self.is_primary_wallet:
-			existing_primary = frappe.get_all("Client Wallet", 
-											filters={
-												"site_name": self.site_name, 
-												"is_primary_wallet": 1,
-												"name": ["!=", self.name]
-											})
-			if existing_primary:
-				frappe.throw(_("A primary wallet already exists for site {0}. Please uncheck 'Is Primary Wallet' or update the existing primary wallet.").format(self.site_name))
+		if self.is_primary_wallet and primary_count:
+			frappe.throw(_("A primary wallet already exists for site {0}. Please uncheck 'Is Primary Wallet' or update the existing primary wallet.").format(self.site_name))
 		
 		# Validate BVN format if provided
 		if self.bvn and len(self.bvn) != 11:
 			frappe.throw(_("BVN must be exactly 11 digits"))
 		
 		# Auto-set first wallet as primary if no primary exists
-		if not self.is_primary_wallet:
-			existing_wallets = frappe.get_all("Client Wallet", 
-											filters={"site_name": self.site_name})
-			if len(existing_wallets) == 0:  # This is the first wallet
-				self.is_primary_wallet = 1
-
-	def validate(self):
-		"""Additional validation rules"""
-		
-		# Validate wallet name uniqueness per site
-		existing_wallet = frappe.get_all("Client Wallet", 
-									   filters={
-										   "site_name": self.site_name,
-										   "wallet_name": self.wallet_name,
-										   "name": ["!=", self.name]
-									   })
-		if existing_wallet:
+		if not self.is_primary_wallet and self.flags.in_insert and not wallet_count:
+			self.is_primary_wallet = 1
+
+	def db_insert(self, *args, **kwargs):
+		"""Insert the wallet, reporting a duplicate wallet name on the same site"""
+		try:
+			super().db_insert(*args, **kwargs)
+		except (frappe.DuplicateEntryError, frappe.UniqueValidationError) as e:
+			self._throw_if_duplicate_wallet_name(e)
+			raise
+	
+	def db_update(self, *args, **kwargs):
+		"""Update the wallet, reporting a duplicate wallet name on the same site"""
+		try:
+			super().db_update(*args, **kwargs)
+		except frappe.UniqueValidationError as e:
+			self._throw_if_duplicate_wallet_name(e)
+			raise
+	
+	def _throw_if_duplicate_wallet_name(self, error):
+		"""Report a wallet name clash within the same site as a per-site duplicate"""
+		if isinstance(error, frappe.DuplicateEntryError):
+			# New wallets are named after wallet_name, so a primary key clash is
+			# a duplicate wallet name
+			filters = self.name
+		else:
+			# wallet_name is also a unique column of its own, which renamed
+			# wallets can clash on; args are (doctype, name, database error)
+			cause = str(error.args[-1]) if error.args else ""
+			if "'wallet_name'" not in cause and "wallet_name_key" not in cause:
+				return
+			filters = {"wallet_name": self.wallet_name, "name": ["!=", self.name]}
+		
+		if frappe.db.get_value("Client Wallet", filters, "site_name") == self.site_name:
 			frappe.throw(_("Wallet name '{0}' already exists for site '{1}'").format(self.wallet_name, self.site_name))
 	
 	def get_wallet_balance(self):
@@ -94,6 +118,75 @@ class ClientWallet(Document):
 		return transaction
 
 # Module-level utility functions
+def on_doctype_update():
+	"""Index the per-site lookups made by the wallet hooks and endpoints"""
+	frappe.db.add_index("Client Wallet", ["site_name", "wallet_sequence"])
+	frappe.db.add_index("Client Wallet", ["site_name", "is_primary_wallet"])
+	
+	# Per-site wallet sequence counters, see _reserve_wallet_sequence
+	frappe.db.sql_ddl("""
+		CREATE TABLE IF NOT EXISTS `tab__Wallet Sequence` (
+			site_name VARCHAR(140) NOT NULL PRIMARY KEY,
+			last_seq BIGINT NOT NULL DEFAULT 0
+		)
+	""")
+	_seed_wallet_sequences()
+
+def _seed_wallet_sequences():
+	"""Start each site's counter after its existing wallets; safe to re-run"""
+	if frappe.db.db_type == "postgres":
+		conflict = "ON CONFLICT (site_name) DO UPDATE SET last_seq = GREATEST(`tab__Wallet Sequence`.last_seq, EXCLUDED.last_seq)"
+	else:
+		conflict = "ON DUPLICATE KEY UPDATE last_seq = GREATEST(last_seq, VALUES(last_seq))"
+	frappe.db.sql(f"""
+		INSERT INTO `tab__Wallet Sequence` (site_name, last_seq)
+		SELECT site_name, COALESCE(MAX(wallet_sequence), 0)
+		FROM `tabClient Wallet`
+		WHERE site_name IS NOT NULL
+		GROUP BY site_name
+		{conflict}
+	""")
+
+def _reserve_wallet_sequence(site_name, count=1):
+	"""Reserve `count` wallet sequence numbers for a site and return the last one
+	
+	A single upsert on the site's counter row, so it costs the same at any table
+	size. The row stays locked until the transaction ends, which keeps concurrent
+	inserts for the site from reserving the same numbers.
+	"""
+	if frappe.db.db_type == "postgres":
+		return frappe.db.sql("""
+			INSERT INTO `tab__Wallet Sequence` (site_name, last_seq) VALUES (%s, %s)
+			ON CONFLICT (site_name) DO UPDATE SET last_seq = `tab__Wallet Sequence`.last_seq + EXCLUDED.last_seq
+			RETURNING last_seq
+		""", (site_name, count))[0][0]
+	
+	frappe.db.sql("""
+		INSERT INTO `tab__Wallet Sequence` (site_name, last_seq) VALUES (%s, %s)
+		ON DUPLICATE KEY UPDATE last_seq = last_seq + VALUES(last_seq)
+	""", (site_name, count))
+	return frappe.db.sql("SELECT last_seq FROM `tab__Wallet Sequence` WHERE site_name = %s", site_name)[0][0]
+
+def _site_wallet_stats(site_name, exclude_name):
+	"""Return (primary wallet count, wallet count) for a site
+	
+	On MariaDB the scanned (site_name, ...) index range is locked until the
+	transaction ends, so concurrent inserts for the same site cannot both
+	become primary. Postgres does not allow FOR UPDATE with aggregates and
+	runs the query unlocked.
+	"""
+	lock = "FOR UPDATE" if frappe.db.db_type == "mariadb" else ""
+	stats = frappe.db.sql(f"""
+		SELECT
+			COALESCE(SUM(is_primary_wallet), 0),
+			COUNT(*)
+		FROM `tabClient Wallet`
+		WHERE site_name = %s AND name <> %s
+		{lock}
+	""", (site_name, exclude_name))
+	
+	return tuple(int(value) for value in stats[0])
+
 @frappe.whitelist()
 def get_wallets_by_site(site_name, status=None):
 	"""Get all wallets for a specific site"""
@@ -103,9 +196,7 @@ def get_wallets_by_site(site_name, status=None):
 	
 	wallets = frappe.get_all("Client Wallet",
 						   filters=filters,
-						   fields=["name", "wallet_name", "wallet_id", "currency", 
-								  "wallet_status", "is_primary_wallet", "account_number",
-								  "wallet_sequence"],
+						   fields=list(_WALLET_LIST_FIELDS),
 						   order_by="wallet_sequence asc")
 	
 	return wallets
@@ -118,62 +209,232 @@ def create_bulk_wallets(site_name, wallet_data):
 	if isinstance(wallet_data, str):
 		wallet_data = json.loads(wallet_data)
 	
-	created_wallets = []
+	# The batch skips the document path, so check the Create permission it would
+	frappe.has_permission("Client Wallet", "create", throw=True)
+	
+	user = frappe.session.user
+	created_wallets = [None] * len(wallet_data)
+	
+	# Wallets passing the batch-level checks are written with multi-row INSERTs,
+	# the rest go through the regular document path so they report their errors.
+	# The savepoint also covers the batch's sequence reservation.
+	frappe.db.savepoint("bulk_wallets")
+	batch_rows, fallback = _prepare_bulk_wallet_rows(site_name, wallet_data, user)
+	
+	if batch_rows:
+		try:
+			frappe.db.bulk_insert("Client Wallet", _BULK_WALLET_FIELDS,
+								[tuple(row[field] for field in _BULK_WALLET_FIELDS) for index, row in batch_rows],
+								chunk_size=1000)
+		except Exception as e:
+			# Only a unique key clash the batch checks could not see (e.g. a
+			# concurrent insert) is recoverable; redo every wallet one by one
+			if not frappe.db.is_duplicate_entry(e):
+				raise
+			frappe.db.rollback(save_point="bulk_wallets")
+			fallback = sorted(fallback + [(index, wallet_data[index]) for index, row in batch_rows],
+							  key=lambda item: item[0])
+			batch_rows = []
+		
+		for index, row in batch_rows:
+			created_wallets[index] = {
+				"name": row["name"],
+				"wallet_name": row["wallet_name"],
+				"wallet_id": row["wallet_id"],
+				"status": "success"
+			}
 	
-	for wallet_info in wallet_data:
+	# All wallets share the request's transaction; a savepoint per wallet
+	# rolls back only the one that fails
+	for index, wallet_info in fallback:
+		save_point = f"bulk_wallet_{index}"
+		frappe.db.savepoint(save_point)
+		
 		wallet_doc = frappe.new_doc("Client Wallet")
 		wallet_doc.site_name = site_name
 		wallet_doc.wallet_name = wallet_info.get("wallet_name")
 		wallet_doc.currency = wallet_info.get("currency", "NGN")
 		wallet_doc.description = wallet_info.get("description", "")
 		wallet_doc.bvn = wallet_info.get("bvn")
+		wallet_doc.flags._created_by = user
 		
 		try:
 			wallet_doc.insert()
-			created_wallets.append({
+			created_wallets[index] = {
 				"name": wallet_doc.name,
 				"wallet_name": wallet_doc.wallet_name,
 				"wallet_id": wallet_doc.wallet_id,
 				"status": "success"
-			})
+			}
 		except Exception as e:
-			created_wallets.append({
+			frappe.db.rollback(save_point=save_point)
+			created_wallets[index] = {
 				"wallet_name": wallet_info.get("wallet_name"),
 				"status": "error",
 				"error": str(e)
-			})
+			}
 	
 	return created_wallets
 
+def _wallet_doc_name(wallet_name):
+	"""Document name for a wallet, or None if only the document path can judge it"""
+	if not isinstance(wallet_name, str):
+		return None
+	name = wallet_name.strip()
+	# Frappe names are at most 140 characters and may not contain < or >
+	if not name or len(name) > 140 or "<" in name or ">" in name:
+		return None
+	return name
+
+def _prepare_bulk_wallet_rows(site_name, wallet_data, user):
+	"""Split wallet_data into ready-to-insert rows and wallets needing the document path
+	
+	Mirrors the before_insert/before_save hooks for the batch with a single stats query
+	and a single sequence reservation.
+	"""
+	# Names as Frappe's field autoname stores them; compared casefolded because
+	# the name column's collation is case-insensitive and ignores trailing spaces
+	names = [_wallet_doc_name(info.get("wallet_name")) for info in wallet_data]
+	lookup_names = [name for name in names if name]
+	taken_names = {name.casefold() for name in frappe.get_all("Client Wallet",
+															 filters={"name": ["in", lookup_names]},
+															 pluck="name")} if lookup_names else set()
+	currencies = frappe.get_meta("Client Wallet").get_options("currency").split("\n")
+	
+	wallet_count = _site_wallet_stats(site_name, "")[1]
+	needs_primary = not wallet_count
+	
+	now = now_datetime()
+	batch_rows, fallback = [], []
+	
+	for index, wallet_info in enumerate(wallet_data):
+		name = names[index]
+		currency = wallet_info.get("currency", "NGN")
+		bvn = wallet_info.get("bvn")
+		
+		if (not name or name.casefold() in taken_names or currency not in currencies
+				or (bvn and len(str(bvn)) != 11)):
+			fallback.append((index, wallet_info))
+			continue
+		
+		taken_names.add(name.casefold())
+		batch_rows.append((index, {
+			"name": name,
+			"owner": user,
+			"creation": now,
+			"modified": now,
+			"modified_by": user,
+			"site_name": site_name,
+			"wallet_name": wallet_info.get("wallet_name"),
+			"currency": currency,
+			"wallet_status": "Active",
+			"description": wallet_info.get("description", ""),
+			"bvn": bvn,
+			"is_primary_wallet": 1 if needs_primary else 0,
+			"account_type": "Wallet",
+			"created_by_user": user,
+			"creation_timestamp": now
+		}))
+		needs_primary = False
+	
+	# One counter update reserves the sequence numbers for the whole batch
+	if batch_rows:
+		sequence = _reserve_wallet_sequence(site_name, len(batch_rows)) - len(batch_rows)
+		for index, row in batch_rows:
+			sequence += 1
+			row["wallet_sequence"] = sequence
+			row["wallet_id"] = f"WLT-{site_name}-{sequence:05d}"
+	
+	return batch_rows, fallback
+
+def upsert_wallet(wallet_data):
+	"""Create a wallet, or update the wallet of the same name on the same site
+	
+	Returns the stored row, or None if the name is taken by another site's wallet.
+	"""
+	site_name = wallet_data["site_name"]
+	# Stored under the same name Frappe's field autoname would give it
+	wallet_name = _wallet_doc_name(wallet_data["wallet_name"])
+	if not wallet_name:
+		frappe.throw(_("Invalid wallet name '{0}'").format(wallet_data["wallet_name"]))
+	
+	currency = wallet_data.get("currency") or "NGN"
+	if currency not in frappe.get_meta("Client Wallet").get_options("currency").split("\n"):
+		frappe.throw(_("Currency {0} is not supported for Client Wallet").format(currency))
+	
+	# Lock the row (or its key gap) so the insert-or-update decision holds until commit
+	existing = frappe.db.sql("""
+		SELECT site_name FROM `tabClient Wallet` WHERE name = %s FOR UPDATE
+	""", (wallet_name,))
+	if existing and existing[0][0] != site_name:
+		return None
+	
+	user = frappe.session.user
+	now = now_datetime()
+	fields = {key: value for key, value in wallet_data.items() if key != "doctype"}
+	fields.update(wallet_name=wallet_name, currency=currency)
+	
+	if existing:
+		# Plain UPDATE by name: a clash on the unique wallet_id or account_number
+		# raises instead of touching another wallet. Refreshed columns missing
+		# from the event are cleared, as re-creating the wallet would.
+		row = {**dict.fromkeys(_UPSERT_WALLET_FIELDS), "account_type": "Wallet", **fields, "modified": now, "modified_by": user}
+		update_fields = [field for field in _UPSERT_WALLET_FIELDS if field != "wallet_id" or row.get("wallet_id")]
+		frappe.db.sql("""
+			UPDATE `tabClient Wallet` SET {updates} WHERE name = %(name)s
+		""".format(updates=", ".join(f"`{field}` = %({field})s" for field in update_fields)),
+			{**row, "name": wallet_name})
+	else:
+		# Only new wallets take a sequence number, so re-sent events leave no gaps
+		wallet_count = _site_wallet_stats(site_name, wallet_name)[1]
+		sequence = _reserve_wallet_sequence(site_name)
+		row = {
+			"wallet_status": "Active",
+			"bvn": None,
+			**fields,
+			"name": wallet_name,
+			"owner": user,
+			"creation": now,
+			"modified": now,
+			"modified_by": user,
+			"wallet_sequence": sequence,
+			"is_primary_wallet": 0 if wallet_count else 1,
+			"created_by_user": user,
+			"creation_timestamp": now
+		}
+		row["wallet_id"] = row.get("wallet_id") or f"WLT-{site_name}-{sequence:05d}"
+		frappe.db.sql("""
+			INSERT INTO `tabClient Wallet` ({columns}) VALUES ({values})
+		""".format(
+			columns=", ".join(f"`{field}`" for field in row),
+			values=", ".join(f"%({field})s" for field in row)
+		), row)
+	
+	return frappe.db.get_value("Client Wallet", wallet_name, "*", as_dict=True)
+
 @frappe.whitelist()
 def get_primary_wallet(site_name):
 	"""Get the primary wallet for a site"""
-	primary_wallet = frappe.get_value("Client Wallet", 
+	primary_wallet = frappe.db.get_value("Client Wallet", 
 									{"site_name": site_name, "is_primary_wallet": 1},
-									["name", "wallet_name", "wallet_id", "currency", "wallet_status"])
-	
-	if primary_wallet:
-		return {
-			"name": primary_wallet[0],
-			"wallet_name": primary_wallet[1],
-			"wallet_id": primary_wallet[2],
-			"currency": primary_wallet[3],
-			"wallet_status": primary_wallet[4]
-		}
-	return None
+									["name", "wallet_name", "wallet_id", "currency", "wallet_status"],
+									as_dict=True)
+	
+	return primary_wallet or None
 
-@frappe.whitelist()
+@frappe.whitelist(methods=["POST"])
 def set_primary_wallet(wallet_name, site_name):
 	"""Set a wallet as the primary wallet for a site"""
-	# First, remove primary flag from all wallets in the site
+	# Otherwise the update below would leave the site without a primary wallet
+	if frappe.db.get_value("Client Wallet", wallet_name, "site_name") != site_name:
+		frappe.throw(_("Wallet {0} does not belong to site {1}").format(wallet_name, site_name))
+	
+	# Flip the primary flag for every wallet in the site in one statement,
+	# so no reader sees the site without a primary wallet
 	frappe.db.sql("""
 		UPDATE `tabClient Wallet` 
-		SET is_primary_wallet = 0 
+		SET is_primary_wallet = CASE WHEN name = %s THEN 1 ELSE 0 END
 		WHERE site_name = %s
-	""", (site_name,))
-	
-	# Set the new primary wallet
-	frappe.db.set_value("Client Wallet", wallet_name, "is_primary_wallet", 1)
-	frappe.db.commit()
+	""", (wallet_name, site_name))
 	
 	return {"status": "success", "message": f"Primary wallet updated for site {site_name}"}
\ No newline at end of file
@@ -1,9 +1,187 @@
 # Copyright (c) 2025, Lassod Consulting Limited and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from buypower_admin.buypower_admin.doctype.client_wallet.client_wallet import (
+	_reserve_wallet_sequence,
+	_seed_wallet_sequences,
+	create_bulk_wallets,
+	on_doctype_update,
+	set_primary_wallet,
+	upsert_wallet,
+)
 
-class TestClientWallet(FrappeTestCase):
-	pass
+
+def make_site():
+	return f"test-{frappe.generate_hash(length=8)}.example.com"
+
+
+def make_wallet_data(site_name, wallet_name, **kwargs):
+	return {
+		"doctype": "Client Wallet",
+		"site_name": site_name,
+		"wallet_name": wallet_name,
+		"currency": "NGN",
+		"account_type": "Wallet",
+		**kwargs,
+	}
+
+
+class WalletTestCase(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		# DDL commits implicitly, so create the counter table before any test data
+		on_doctype_update()
+		super().setUpClass()
+
+
+class TestClientWallet(WalletTestCase):
+	def test_upsert_same_site_updates_in_place(self):
+		site = make_site()
+		name = f"W-{frappe.generate_hash(length=8)}"
+
+		created = upsert_wallet(make_wallet_data(site, name, bank_name="First Bank", description="Main"))
+		self.assertEqual(created.site_name, site)
+		self.assertEqual(created.wallet_sequence, 1)
+		self.assertEqual(created.is_primary_wallet, 1)
+		self.assertEqual(created.wallet_id, f"WLT-{site}-00001")
+
+		updated = upsert_wallet(make_wallet_data(site, name, currency="USD", bank_name="Second Bank"))
+		self.assertEqual(updated.name, created.name)
+		self.assertEqual(updated.currency, "USD")
+		self.assertEqual(updated.bank_name, "Second Bank")
+		# Refreshed columns the event leaves out are cleared
+		self.assertIsNone(updated.description)
+		self.assertEqual(updated.wallet_sequence, 1)
+		self.assertEqual(updated.wallet_id, created.wallet_id)
+
+		# Re-sending a wallet does not consume a sequence number
+		self.assertEqual(_reserve_wallet_sequence(site), 2)
+
+	def test_upsert_other_site_is_rejected(self):
+		name = f"W-{frappe.generate_hash(length=8)}"
+		site = make_site()
+		upsert_wallet(make_wallet_data(site, name, bank_name="First Bank"))
+
+		self.assertIsNone(upsert_wallet(make_wallet_data(make_site(), name, bank_name="Other Bank")))
+		self.assertEqual(frappe.db.get_value("Client Wallet", name, "site_name"), site)
+		self.assertEqual(frappe.db.get_value("Client Wallet", name, "bank_name"), "First Bank")
+
+	def test_upsert_account_number_clash_changes_nothing(self):
+		site = make_site()
+		account_number = frappe.generate_hash(length=10)
+		first = f"W-{frappe.generate_hash(length=8)}"
+		second = f"W-{frappe.generate_hash(length=8)}"
+		upsert_wallet(make_wallet_data(site, first, account_number=account_number, bank_name="First Bank"))
+
+		with self.assertRaises(Exception):
+			upsert_wallet(make_wallet_data(site, second, account_number=account_number, bank_name="Other Bank"))
+
+		self.assertFalse(frappe.db.exists("Client Wallet", second))
+		self.assertEqual(frappe.db.get_value("Client Wallet", first, "bank_name"), "First Bank")
+
+	def test_upsert_rejects_unknown_currency(self):
+		site = make_site()
+		name = f"W-{frappe.generate_hash(length=8)}"
+
+		with self.assertRaises(frappe.ValidationError):
+			upsert_wallet(make_wallet_data(site, name, currency="XYZ"))
+		self.assertFalse(frappe.db.exists("Client Wallet", name))
+
+	def test_upsert_normalises_name_and_currency(self):
+		site = make_site()
+		name = f"W-{frappe.generate_hash(length=8)}"
+
+		created = upsert_wallet(make_wallet_data(site, f" {name} ", currency=None))
+		self.assertEqual(created.name, name)
+		self.assertEqual(created.wallet_name, name)
+		self.assertEqual(created.currency, "NGN")
+
+		# The padded name refers to the same wallet
+		updated = upsert_wallet(make_wallet_data(site, f"{name} ", currency="USD"))
+		self.assertEqual(updated.name, name)
+		self.assertEqual(updated.currency, "USD")
+		self.assertEqual(updated.wallet_sequence, 1)
+
+	def test_duplicate_wallet_name_on_update(self):
+		site = make_site()
+		first = frappe.get_doc(make_wallet_data(site, f"W-{frappe.generate_hash(length=8)}")).insert()
+		second = frappe.get_doc(make_wallet_data(site, f"W-{frappe.generate_hash(length=8)}")).insert()
+
+		# wallet_name is unique on its own, apart from the document name
+		second.wallet_name = first.wallet_name
+		with self.assertRaisesRegex(frappe.ValidationError, "already exists for site"):
+			second.save()
+
+	def test_set_primary_wallet_checks_site(self):
+		site = make_site()
+		first = upsert_wallet(make_wallet_data(site, f"W-{frappe.generate_hash(length=8)}"))
+		second = upsert_wallet(make_wallet_data(site, f"W-{frappe.generate_hash(length=8)}"))
+		other = upsert_wallet(make_wallet_data(make_site(), f"W-{frappe.generate_hash(length=8)}"))
+
+		with self.assertRaises(frappe.ValidationError):
+			set_primary_wallet(other.name, site)
+		self.assertEqual(frappe.db.get_value("Client Wallet", first.name, "is_primary_wallet"), 1)
+
+		set_primary_wallet(second.name, site)
+		self.assertEqual(frappe.db.get_value("Client Wallet", first.name, "is_primary_wallet"), 0)
+		self.assertEqual(frappe.db.get_value("Client Wallet", second.name, "is_primary_wallet"), 1)
+
+class TestWalletSequence(WalletTestCase):
+	def test_sequence_seeding_and_reservation(self):
+		site = make_site()
+		name = f"W-{frappe.generate_hash(length=8)}"
+		upsert_wallet(make_wallet_data(site, name))
+
+		# Simulate a site whose wallets predate the counter table
+		frappe.db.sql("UPDATE `tabClient Wallet` SET wallet_sequence = 7 WHERE name = %s", name)
+		frappe.db.sql("DELETE FROM `tab__Wallet Sequence` WHERE site_name = %s", site)
+		_seed_wallet_sequences()
+		_seed_wallet_sequences()
+
+		self.assertEqual(_reserve_wallet_sequence(site), 8)
+		# A batch reservation returns the last number of the block
+		self.assertEqual(_reserve_wallet_sequence(site, 3), 11)
+		self.assertEqual(_reserve_wallet_sequence(site), 12)
+
+
+class TestBulkWallets(WalletTestCase):
+	def test_bulk_wallets_mixed_rows(self):
+		site = make_site()
+		prefix = frappe.generate_hash(length=8)
+		upsert_wallet(make_wallet_data(site, f"{prefix}-Main"))
+
+		results = create_bulk_wallets(site, [
+			{"wallet_name": f"{prefix}-Alpha"},
+			{"wallet_name": f"{prefix}-alpha"},
+			{"wallet_name": f"{prefix}-main"},
+			{"wallet_name": f"{prefix}-Beta", "currency": "XYZ"},
+			{"wallet_name": f"{prefix}-Gamma ", "bvn": "123"},
+			{"wallet_name": f"{prefix}-Delta "},
+		])
+
+		self.assertEqual([result["status"] for result in results],
+						 ["success", "error", "error", "error", "error", "success"])
+		self.assertEqual(results[5]["name"], f"{prefix}-Delta")
+
+		alpha = frappe.db.get_value("Client Wallet", f"{prefix}-Alpha",
+									["wallet_sequence", "is_primary_wallet"], as_dict=True)
+		delta = frappe.db.get_value("Client Wallet", f"{prefix}-Delta",
+									["wallet_sequence", "is_primary_wallet"], as_dict=True)
+		self.assertEqual((alpha.wallet_sequence, alpha.is_primary_wallet), (2, 0))
+		self.assertEqual((delta.wallet_sequence, delta.is_primary_wallet), (3, 0))
+		self.assertFalse(frappe.db.exists("Client Wallet", f"{prefix}-Beta"))
+		self.assertFalse(frappe.db.exists("Client Wallet", f"{prefix}-Gamma"))
+
+	def test_bulk_wallets_first_wallet_is_primary(self):
+		site = make_site()
+		prefix = frappe.generate_hash(length=8)
+
+		results = create_bulk_wallets(site, [{"wallet_name": f"{prefix}-One"}, {"wallet_name": f"{prefix}-Two"}])
+
+		self.assertEqual([result["wallet_id"] for result in results],
+						 [f"WLT-{site}-00001", f"WLT-{site}-00002"])
+		self.assertEqual(frappe.db.get_value("Client Wallet", f"{prefix}-One", "is_primary_wallet"), 1)
+		self.assertEqual(frappe.db.get_value("Client Wallet", f"{prefix}-Two", "is_primary_wallet"), 0)
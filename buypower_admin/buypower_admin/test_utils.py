@@ -0,0 +1,121 @@
+# Copyright (c) 2025, Lassod Consulting Limited and Contributors
+# See license.txt
+
+import json
+from collections import deque
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from buypower_admin.buypower_admin.doctype.client_wallet.client_wallet import on_doctype_update
+from buypower_admin.buypower_admin.doctype.client_wallet.test_client_wallet import make_site
+from buypower_admin.buypower_admin.utils import (
+	_ADMIN_LOG_DOCTYPE,
+	_flush_log_buffer,
+	_insert_admin_log,
+	client_wallet,
+	safe_log_error,
+)
+
+
+def post_client_wallet(payload):
+	"""Call the client_wallet endpoint as if payload was POSTed as JSON"""
+	raw = json.dumps(payload)
+	request = frappe._dict(get_data=lambda as_text=False: raw)
+	with patch.object(frappe.local, "request", request, create=True):
+		return client_wallet()
+
+
+class TestLogBuffer(FrappeTestCase):
+	def setUp(self):
+		frappe.local.wallet_log_buffer = deque(maxlen=256)
+
+	def test_flush_log_buffer_writes_error_logs(self):
+		title = f"Test {frappe.generate_hash(length=8)}"
+		frappe.local.request = frappe._dict()
+		try:
+			safe_log_error("buffered message", title)
+			self.assertFalse(frappe.db.exists("Error Log", {"method": title}))
+			self.assertEqual(len(frappe.local.wallet_log_buffer), 1)
+		finally:
+			del frappe.local.request
+
+		frappe.local.wallet_log_buffer.append((f"{title} 2", "second message", now_datetime()))
+		# The hook commits; keep the test inside its own transaction
+		with patch.object(frappe.db.__class__, "commit"):
+			_flush_log_buffer()
+
+		self.assertEqual(frappe.db.get_value("Error Log", {"method": title}, "error"), "buffered message")
+		self.assertTrue(frappe.db.exists("Error Log", {"method": f"{title} 2"}))
+		self.assertFalse(frappe.local.wallet_log_buffer)
+
+
+class TestAdminLog(FrappeTestCase):
+	def test_raw_insert_named_by_transaction_reference(self):
+		reference = f"REF-{frappe.generate_hash(length=10)}"
+		_insert_admin_log({"event": "invoice.paid", "transaction_reference": reference, "amount": 150.0})
+
+		log = frappe.db.get_value(_ADMIN_LOG_DOCTYPE, reference,
+								  ["event", "amount", "owner", "creation"], as_dict=True)
+		self.assertEqual(log.event, "invoice.paid")
+		self.assertEqual(log.amount, 150.0)
+		self.assertEqual(log.owner, frappe.session.user)
+		self.assertIsNotNone(log.creation)
+
+	def test_raw_insert_without_reference_gets_hash_name(self):
+		event = f"test.{frappe.generate_hash(length=8)}"
+		_insert_admin_log({"event": event, "transaction_reference": None})
+
+		names = frappe.get_all(_ADMIN_LOG_DOCTYPE, filters={"event": event}, pluck="name")
+		self.assertEqual(len(names), 1)
+		self.assertEqual(len(names[0]), 10)
+
+	def test_doc_insert_when_flag_is_set(self):
+		reference = f"REF-{frappe.generate_hash(length=10)}"
+		with patch.dict(frappe.local.conf, {"admin_log_doc_insert": 1}), \
+				patch("frappe.get_doc", wraps=frappe.get_doc) as get_doc:
+			_insert_admin_log({"event": "invoice.paid", "transaction_reference": reference})
+
+		self.assertEqual(get_doc.call_args_list[0].args[0]["doctype"], _ADMIN_LOG_DOCTYPE)
+		self.assertEqual(frappe.db.get_value(_ADMIN_LOG_DOCTYPE, reference, "event"), "invoice.paid")
+
+
+class TestClientWalletWebhook(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		# DDL commits implicitly, so create the counter table before any test data
+		on_doctype_update()
+		super().setUpClass()
+
+	def test_wallet_created_dispatch(self):
+		site = make_site()
+		name = f"W-{frappe.generate_hash(length=8)}"
+
+		response = post_client_wallet({
+			"event": "wallet_created",
+			"data": {"wallet_name": name, "site_name": site, "bvn": "123 4567 8901"},
+		})
+
+		self.assertTrue(response["success"])
+		self.assertEqual(response["wallet_data"].name, name)
+		wallet = frappe.db.get_value("Client Wallet", name, ["site_name", "currency", "bvn"], as_dict=True)
+		self.assertEqual((wallet.site_name, wallet.currency, wallet.bvn), (site, "NGN", "12345678901"))
+
+	def test_wallet_created_requires_site(self):
+		response = post_client_wallet({"event": "wallet_created", "data": {"wallet_name": "W-no-site"}})
+
+		self.assertEqual(response, {"success": False, "error": "site_name is required"})
+
+	def test_unknown_event_is_rejected(self):
+		name = f"W-{frappe.generate_hash(length=8)}"
+
+		response = post_client_wallet({
+			"event": "wallet_deleted",
+			"data": {"wallet_name": name, "site_name": make_site()},
+		})
+
+		self.assertFalse(response["success"])
+		self.assertEqual(response["error"], "Invalid event type. Expected 'wallet_created', got 'wallet_deleted'")
+		self.assertFalse(frappe.db.exists("Client Wallet", name))
@@ -2,7 +2,35 @@ import frappe
 import json
 import hmac
 import hashlib
+import re
+from collections import deque
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from frappe.utils import now_datetime
+
+from buypower_admin.buypower_admin.doctype.client_wallet.client_wallet import upsert_wallet
+
+# Doctype name has a double space, kept as-is
+_ADMIN_LOG_DOCTYPE = "Purpledove Admin  Log"
+
+_NON_DIGIT = re.compile(r"\D")
+_BVN_LEN = 11
+
+# Shared by background forwarding jobs so retries and later jobs in the same
+# worker reuse pooled TLS connections to client sites
+_FORWARD_SESSION = requests.Session()
+_FORWARD_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    # Only retry failed connections: after a read error or a 5xx the client
+    # site may already have processed the event, and a re-send could credit it twice
+    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2, allowed_methods=["POST"]),
+))
+_FORWARD_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+# (connect, read) seconds; bounds how long a worker can stall on a client site
+_FORWARD_TIMEOUT = (3, 10)
 
 def safe_log_error(message, title="Log"):
     """Safely log errors with proper title length limits"""
@@ -14,6 +42,13 @@ def safe_log_error(message, title="Log"):
     if len(str(message)) > 3000:
         message = str(message)[:3000] + "... (truncated)"
     
+    # During a web request, buffer the entry; _flush_log_buffer writes them all at once
+    if getattr(frappe.local, "request", None) is not None:
+        if not hasattr(frappe.local, "wallet_log_buffer"):
+            frappe.local.wallet_log_buffer = deque(maxlen=256)
+        frappe.local.wallet_log_buffer.append((title, str(message), now_datetime()))
+        return
+    
     try:
         frappe.log_error(message=str(message), title=title)
     except Exception:
@@ -21,6 +56,27 @@ def safe_log_error(message, title="Log"):
         print(f"Log failed: {title} - {str(message)[:100]}")
 
 
+def _flush_log_buffer():
+    """after_request hook: write the request's buffered safe_log_error entries in one INSERT"""
+    log_buffer = getattr(frappe.local, "wallet_log_buffer", None)
+    if not log_buffer:
+        return
+    
+    user = getattr(frappe.session, "user", None) or "Guest"
+    values = [
+        (frappe.generate_hash(length=10), title, message, timestamp, timestamp, user, user)
+        for title, message, timestamp in log_buffer
+    ]
+    log_buffer.clear()
+    
+    try:
+        # Frappe has already committed the request's own transaction at this point
+        frappe.db.bulk_insert("Error Log", ["name", "method", "error", "creation", "modified", "owner", "modified_by"], values)
+        frappe.db.commit()
+    except Exception:
+        frappe.logger().error(f"Failed to flush {len(values)} buffered wallet log entries", exc_info=True)
+
+
 
 
 
@@ -56,17 +112,53 @@ def _verify_webhook_signature(raw_body):
 
 
 def _forward_to_site(site_name, payload):
-    """Forward the webhook payload to a client site's wallet_log endpoint."""
+    """Forward the webhook payload to a client site's wallet_log endpoint.
+
+    Runs as a background job, see `wallet_log`.
+    """
     if not site_name:
         return
     url = f"https://{site_name}/api/method/purpledove_payment.utils.wallet_log"
     try:
-        requests.post(url, json=payload, timeout=5)
+        _FORWARD_SESSION.post(url, json=payload, headers=_FORWARD_HEADERS, timeout=_FORWARD_TIMEOUT)
     except Exception as post_error:
         frappe.log_error(title="Wallet Forwarding Error", message=f"Failed to POST to {url}: {str(post_error)}")
 
 
-@frappe.whitelist(allow_guest=True)
+def _insert_admin_log(row):
+    """
+    Append a row to the admin log with a plain INSERT.
+
+    The log is append-only and its controller has no hooks, so the document
+    lifecycle is skipped. Set `admin_log_doc_insert` in site config to go
+    through frappe.get_doc(...).insert() instead.
+    """
+    if frappe.conf.get("admin_log_doc_insert"):
+        frappe.get_doc({"doctype": _ADMIN_LOG_DOCTYPE, **row}).insert(ignore_permissions=True)
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    row = {
+        # Same name the DocType's format:{transaction_reference} autoname gives
+        "name": row.get("transaction_reference") or frappe.generate_hash(length=10),
+        "creation": now,
+        "modified": now,
+        "owner": user,
+        "modified_by": user,
+        **row,
+    }
+    frappe.db.sql(
+        "INSERT INTO `tab{doctype}` ({columns}) VALUES ({values})".format(
+            doctype=_ADMIN_LOG_DOCTYPE,
+            columns=", ".join(f"`{column}`" for column in row),
+            values=", ".join(f"%({column})s" for column in row),
+        ),
+        row,
+    )
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
 def wallet_log():
     """
     Central BuyPower MFB webhook receiver.
@@ -83,7 +175,7 @@ def wallet_log():
             frappe.local.response["http_status_code"] = 401
             return {"success": False, "error": "Invalid webhook signature"}
 
-        payload = json.loads(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+        payload = orjson.loads(raw)
 
         # v2 uses "type"; legacy uses "event"
         event = payload.get("type") or payload.get("event")
@@ -116,9 +208,8 @@ def wallet_log():
             our_account = source.get("accountNumber") or metadata.get("source_account_number")
         our_account = our_account or data.get("accountNumber")
 
-        # Insert admin log (doctype name has a double space, kept as-is)
-        wallet_log_doc = frappe.get_doc({
-            "doctype": "Purpledove Admin  Log",
+        # Insert admin log
+        _insert_admin_log({
             "event": event,
             "transaction_reference": data.get("reference") or data.get("transactionReference"),
             "session_id": data.get("sessionId"),
@@ -136,10 +227,9 @@ def wallet_log():
             "transaction_type": transaction_type,
             "status": log_status,
             "narration": data.get("narration"),
-            "metadata": json.dumps(metadata),
-            "data_details": json.dumps(payload),
+            "metadata": orjson.dumps(metadata).decode(),
+            "data_details": orjson.dumps(payload).decode(),
         })
-        wallet_log_doc.insert(ignore_permissions=True)
 
         # Resolve the destination site for forwarding.
         # Transfers carry the originating site in metadata; inflows are matched
@@ -147,30 +237,29 @@ def wallet_log():
         client_wallet_info = None
         site_name = metadata.get("site") if is_transfer else None
         if not site_name and our_account:
-            wallet_list = frappe.get_all(
+            client_wallet_info = frappe.db.get_value(
                 "Client Wallet",
-                filters={"account_number": our_account},
-                fields=["name", "wallet_name", "account_number", "site_name", "wallet_status"],
-                limit=1,
+                {"account_number": our_account},
+                ["name", "wallet_name", "account_number", "site_name", "wallet_status"],
+                as_dict=True,
             )
-            if wallet_list:
-                cw = wallet_list[0]
-                site_name = cw.site_name
-                client_wallet_info = {
-                    "name": cw.name,
-                    "wallet_name": cw.wallet_name,
-                    "account_number": cw.account_number,
-                    "site_name": cw.site_name,
-                    "wallet_status": cw.wallet_status,
-                }
+            if client_wallet_info:
+                site_name = client_wallet_info.site_name
             elif is_inflow:
                 frappe.log_error(
                     title="Inflow Webhook Not Forwarded",
                     message=f"No Client Wallet found for account_number={our_account!r}. Event '{event}' dropped."
                 )
 
-        _forward_to_site(site_name, payload)
-        frappe.db.commit()
+        if site_name:
+            # Forward once the log row is committed; the webhook does not wait on the client site
+            frappe.enqueue(
+                "buypower_admin.buypower_admin.utils._forward_to_site",
+                queue="short",
+                enqueue_after_commit=True,
+                site_name=site_name,
+                payload=payload,
+            )
 
         return {
             "success": True,
@@ -186,31 +275,132 @@ def wallet_log():
         return {"success": False, "error": str(e)}
 
 
-@frappe.whitelist(allow_guest=True)
+# (Client Wallet field, default) pairs copied from a wallet_created payload
+_WALLET_FIELD_MAP = (
+    ("site_name", None),
+    ("wallet_name", None),
+    ("currency", "NGN"),
+    ("wallet_id", None),
+    ("description", None),
+    ("account_number", None),
+    ("exchange_ref", None),
+    ("business_id", None),
+    ("account_type", "Wallet"),
+    ("bank_code", None),
+    ("bank_name", None),
+)
+
+
+def _build_wallet_data(transaction_data):
+    """Map a wallet_created payload onto a Client Wallet record (BVN is added by the caller)"""
+    return {
+        "doctype": "Client Wallet",
+        **{field: transaction_data.get(field, default) for field, default in _WALLET_FIELD_MAP},
+    }
+
+
+def _handle_wallet_created(transaction_data, verbose=False):
+    """Create or refresh a Client Wallet from a wallet_created event"""
+    # Check if required wallet data is present
+    wallet_name = transaction_data.get("wallet_name")
+    if not wallet_name:
+        return {"success": False, "error": "wallet_name is required"}
+    
+    # Get site_name from transaction data, with fallback
+    site_name = transaction_data.get("site_name", "")
+    if not site_name:
+        return {"success": False, "error": "site_name is required"}
+    
+    # Handle BVN validation more gracefully
+    bvn = transaction_data.get("bvn")
+    bvn_to_save = None
+    bvn_warning = None
+    
+    if bvn:
+        # Remove any spaces or special characters
+        bvn_clean = _NON_DIGIT.sub("", str(bvn))
+        
+        # Check if BVN is exactly 11 digits
+        if len(bvn_clean) == _BVN_LEN:
+            bvn_to_save = bvn_clean
+            if verbose:
+                safe_log_error(f"Valid BVN for wallet: {wallet_name}", "BVN Valid")
+        else:
+            # Option 1: Skip BVN and continue (more graceful)
+            bvn_warning = f"Invalid BVN provided ({len(bvn_clean)} digits), wallet created without BVN"
+            safe_log_error(bvn_warning, "BVN Warning")
+            
+            # Option 2: Return error (stricter approach)
+            # return {"success": False, "error": "BVN must be exactly 11 digits"}
+    
+    if verbose:
+        safe_log_error(f"Processing wallet: {wallet_name} for site: {site_name}", "Processing")
+    
+    # Build the Client Wallet record
+    wallet_data = _build_wallet_data(transaction_data)
+    
+    # Only add BVN if it's valid
+    if bvn_to_save:
+        wallet_data["bvn"] = bvn_to_save
+    
+    # Create the wallet, or refresh the existing one for this site
+    wallet = upsert_wallet(wallet_data)
+    if not wallet:
+        return {"success": False, "error": f"Wallet name '{wallet_name}' is already used by another site"}
+    
+    # Log successful creation
+    if verbose:
+        safe_log_error(f"Successfully created Client Wallet: {wallet_name}", "Success")
+
+    response = {
+        "success": True, 
+        "message": "Wallet created successfully",
+        "wallet_data": wallet
+    }
+    
+    # Add warning if BVN was invalid
+    if bvn_warning:
+        response["warning"] = bvn_warning
+    
+    return response
+
+
+# client_wallet event -> handler(transaction_data, verbose)
+_EVENT_HANDLERS = {
+    "wallet_created": _handle_wallet_created,
+}
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
 def client_wallet():
     """Handle wallet creation requests from client systems"""
+    # Request tracing logs are only written when enabled in site config
+    verbose = frappe.conf.get("verbose_wallet_logs")
     try:
         # Get the raw request for debugging - FIXED LINE 103
         raw_data = frappe.request.get_data(as_text=True)
-        safe_log_error(f"Raw data: {raw_data[:200]}", "Client Req")
+        if verbose:
+            safe_log_error(f"Raw data: {raw_data[:200]}", "Client Req")
         
         # Get the incoming request data - handle multiple formats
         payload = None
         
         # Try JSON first
         try:
-            payload = json.loads(raw_data)
-            safe_log_error("Successfully parsed as JSON", "Req Format")
+            payload = orjson.loads(raw_data)
+            if verbose:
+                safe_log_error("Successfully parsed as JSON", "Req Format")
         except json.JSONDecodeError:
             # Try form data
             form_data = frappe.form_dict
-            safe_log_error(f"Form data: {dict(form_data)}", "Form Data")
+            if verbose:
+                safe_log_error(f"Form data: {dict(form_data)}", "Form Data")
             
             if form_data.get('event') and form_data.get('data'):
                 try:
                     data_value = form_data.get('data')
                     if isinstance(data_value, str):
-                        parsed_data = json.loads(data_value)
+                        parsed_data = orjson.loads(data_value)
                     else:
                         parsed_data = data_value
                     
@@ -218,7 +408,8 @@ def client_wallet():
                         'event': form_data.get('event'),
                         'data': parsed_data
                     }
-                    safe_log_error("Successfully parsed form data", "Req Format")
+                    if verbose:
+                        safe_log_error("Successfully parsed form data", "Req Format")
                 except json.JSONDecodeError as e:
                     safe_log_error(f"Form JSON error: {str(e)[:50]}", "Form Err")
                     return {"success": False, "error": "Invalid JSON in form data"}
@@ -230,107 +421,24 @@ def client_wallet():
             return {"success": False, "error": "Could not parse request data"}
 
         # Log the parsed payload safely
-        log_payload = payload.copy()
-        if log_payload.get("data", {}).get("bvn"):
-            log_payload["data"]["bvn"] = "***masked***"
-        safe_log_error(f"Payload: {json.dumps(log_payload, indent=2)[:300]}", "Parsed Payload")
+        if verbose:
+            log_payload = payload
+            if payload.get("data", {}).get("bvn"):
+                # Mask on a copy; the payload's own data is used below
+                log_payload = {**payload, "data": {**payload["data"], "bvn": "***masked***"}}
+            safe_log_error(f"Payload: {orjson.dumps(log_payload).decode()[:300]}", "Parsed Payload")
 
         # Extract the "event" and "data" fields from the payload
         event = payload.get("event")
         transaction_data = payload.get("data", {})
         
         # Validate event type
-        if event != "wallet_created":
-            return {"success": False, "error": f"Invalid event type. Expected 'wallet_created', got '{event}'"}
-        
-        # Check if required wallet data is present
-        wallet_name = transaction_data.get("wallet_name")
-        if not wallet_name:
-            return {"success": False, "error": "wallet_name is required"}
-        
-        # Get site_name from transaction data, with fallback
-        site_name = transaction_data.get("site_name", "")
-        if not site_name:
-            return {"success": False, "error": "site_name is required"}
-        
-        # Handle BVN validation more gracefully
-        bvn = transaction_data.get("bvn")
-        bvn_to_save = None
-        bvn_warning = None
-        
-        if bvn:
-            # Remove any spaces or special characters
-            bvn_clean = ''.join(filter(str.isdigit, str(bvn)))
-            
-            # Check if BVN is exactly 11 digits
-            if len(bvn_clean) == 11:
-                bvn_to_save = bvn_clean
-                safe_log_error(f"Valid BVN for wallet: {wallet_name}", "BVN Valid")
-            else:
-                # Option 1: Skip BVN and continue (more graceful)
-                bvn_warning = f"Invalid BVN provided ({len(bvn_clean)} digits), wallet created without BVN"
-                safe_log_error(bvn_warning, "BVN Warning")
-                
-                # Option 2: Return error (stricter approach)
-                # return {"success": False, "error": "BVN must be exactly 11 digits"}
-        
-        safe_log_error(f"Processing wallet: {wallet_name} for site: {site_name}", "Processing")
-        
-        # Check if a wallet with the same name already exists for this site
-        existing_wallet = frappe.db.exists("Client Wallet", {
-            "wallet_name": wallet_name,
-            "site_name": site_name
-        })
-        
-        if existing_wallet:
-            # Get existing wallet details for logging
-            existing_doc = frappe.get_doc("Client Wallet", existing_wallet)
-            safe_log_error(f"Replacing existing wallet: {wallet_name}", "Replacing")
-            
-            # Delete the existing record
-            frappe.delete_doc("Client Wallet", existing_wallet, ignore_permissions=True)
-            frappe.db.commit()
-        
-        # Create a new record in the Client Wallet Doctype
-        wallet_data = {
-            "doctype": "Client Wallet",
-            "site_name": site_name,
-            "wallet_name": wallet_name,
-            "currency": transaction_data.get("currency", "NGN"),
-            "wallet_id": transaction_data.get("wallet_id"),
-            "description": transaction_data.get("description"),
-            "account_number": transaction_data.get("account_number"),
-            "exchange_ref": transaction_data.get("exchange_ref"),
-            "business_id": transaction_data.get("business_id"),
-            "account_type": transaction_data.get("account_type", "Wallet"),
-            "bank_code": transaction_data.get("bank_code"),
-            "bank_name": transaction_data.get("bank_name")
-        }
-        
-        # Only add BVN if it's valid
-        if bvn_to_save:
-            wallet_data["bvn"] = bvn_to_save
-        
-        client_wallet_doc = frappe.get_doc(wallet_data)
-        
-        # Save the document
-        client_wallet_doc.save(ignore_permissions=True)
-        frappe.db.commit()
-        
-        # Log successful creation
-        safe_log_error(f"Successfully created Client Wallet: {wallet_name}", "Success")
-
-        response = {
-            "success": True, 
-            "message": "Wallet created successfully",
-            "wallet_data": client_wallet_doc.as_dict()
-        }
-        
-        # Add warning if BVN was invalid
-        if bvn_warning:
-            response["warning"] = bvn_warning
+        handler = _EVENT_HANDLERS.get(event)
+        if not handler:
+            expected = ", ".join(f"'{name}'" for name in _EVENT_HANDLERS)
+            return {"success": False, "error": f"Invalid event type. Expected {expected}, got '{event}'"}
         
-        return response
+        return handler(transaction_data, verbose)
 
     except json.JSONDecodeError as e:
         safe_log_error(f"JSON decode error: {str(e)}", "JSON Error")
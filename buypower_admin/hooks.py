@@ -176,7 +176,7 @@ app_license = "MIT"
 # Request Events
 # ----------------
 # before_request = ["buypower_admin.utils.before_request"]
-# after_request = ["buypower_admin.utils.after_request"]
+after_request = ["buypower_admin.buypower_admin.utils._flush_log_buffer"]
 
 # Job Events
 # ----------
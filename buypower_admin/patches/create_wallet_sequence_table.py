@@ -0,0 +1,6 @@
+from buypower_admin.buypower_admin.doctype.client_wallet.client_wallet import on_doctype_update
+
+
+def execute():
+	"""Create the Client Wallet indexes and the seeded wallet sequence table on existing sites"""
+	on_doctype_update()